@@ -9,10 +9,13 @@
 # at https://www.sourcefabric.org/superdesk/license
 
 import logging
-from datetime import timedelta
+import re
+from datetime import datetime, timedelta
+from itertools import islice
 
 from dateutil.parser import parse
 from gspread import Cell
+from pytz import timezone, utc
 from pytz.exceptions import UnknownTimeZoneError
 
 import superdesk
@@ -21,10 +24,34 @@ from superdesk.io.feed_parsers import FeedParser
 from superdesk.io.registry import register_feed_parser
 from superdesk.metadata.item import CONTENT_STATE, GUID_NEWSML, ITEM_STATE
 from superdesk.metadata.utils import generate_guid
-from superdesk.utc import local_to_utc
 
 logger = logging.getLogger(__name__)
 
+_DATE_RE = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})')
+_TIME_RE = re.compile(r'(\d{1,2}):(\d{2})(?::(\d{2}))?')
+
+
+def _fast_parse(date_str, time_str=None):
+    """Parse date (and time) cells
+
+    ``YYYY-MM-DD`` dates and ``H:MM[:SS]`` times are built directly, anything else goes through dateutil.
+    """
+    date_match = _DATE_RE.fullmatch(date_str)
+    time_match = _TIME_RE.fullmatch(time_str) if time_str is not None else None
+    if date_match and (time_str is None or time_match):
+        parts = date_match.groups() + (time_match.groups('0') if time_match else ())
+        try:
+            return datetime(*map(int, parts))
+        except ValueError:  # out of range values, let dateutil report it
+            pass
+    return parse(date_str if time_str is None else date_str + ' ' + time_str)
+
+
+def _add_cell(cells_list, row, values, col, value):
+    """Add cell update unless the sheet already contains the value"""
+    if (values[col] if col < len(values) else '') != value:
+        cells_list.append(Cell(row, col + 1, value))
+
 
 class BelgaSpreadsheetParser(FeedParser):
     """Feed Parser for Spreadsheet"""
@@ -58,6 +85,12 @@ class BelgaSpreadsheetParser(FeedParser):
         'Planned, occurs certainly': 'eocstat:eos5',
     }
 
+    # item occur_status values by sheet value
+    occur_statuses = {
+        name: {'qcode': qcode, 'name': name, 'label': name.lower()}
+        for name, qcode in occur_status_qcode_mapping.items()
+    }
+
     def can_parse(self, titles):
         try:
             self.parse_titles(titles)
@@ -67,65 +100,113 @@ class BelgaSpreadsheetParser(FeedParser):
 
     def parse(self, data, provider=None):
         index = self.parse_titles(data[0])
+        # resolve columns once, rows are accessed by position only
+        i_start_date = index['Start date']
+        i_start_time = index['Start time']
+        i_end_date = index['End date']
+        i_end_time = index['End time']
+        i_all_day = index['All day']
+        i_timezone = index['Timezone']
+        i_slugline = index['Slugline']
+        i_name = index['Event name']
+        i_description = index['Description']
+        i_occur_status = index['Occurence status']
+        i_calendars = index['Calendars']
+        i_location_name = index['Location Name']
+        i_location_address = index['Location Address']
+        i_location_city = index['Location City/Town']
+        i_location_area = index['Location State/Province/Region']
+        i_location_country = index['Location Country']
+        i_honorific = index['Contact Honorific']
+        i_first_name = index['Contact First name']
+        i_last_name = index['Contact Last name']
+        i_organisation = index['Contact Organisation']
+        i_contact_address = index['Contact Point of Contact']
+        i_email = index['Contact Email']
+        i_phone_number = index['Contact Phone Number']
+        i_phone_usage = index['Contact Phone Usage']
+        i_phone_public = index['Contact Phone Public']
+        i_long_description = index['Long description']
+        i_internal_note = index['Internal note']
+        i_ednote = index['Ed note']
+        i_links = index['External links']
+        i_status = index['_STATUS']
+        i_err_message = index['_ERR_MESSAGE']
+        i_guid = index['_GUID']
+        location_idx = tuple(index[field] for field in self.required_location_field)
+        contact_idx = tuple(index[field] for field in self.required_contact_field)
+        occur_statuses = self.occur_statuses
+
+        # validate existing guids with a single query instead of one per row
+        guids = [
+            values[i_guid] for values in islice(data, 2, None)
+            if len(values) - 1 > i_status and values[i_status].strip().upper() in ('UPDATED', 'ERROR')
+            and values[i_guid]
+        ]
+        existing_guids = set()
+        if guids:
+            events = superdesk.get_resource_service('events').find({'guid': {'$in': guids}})
+            existing_guids = {event['guid'] for event in events}
+
         items = []
         cells_list = []  # use for patch update to reduce write requests usage
+        tz_cache = {}  # timezone objects by name, most sheets only use a couple of them
         # skip first two title rows
-        for row in range(3, len(data) + 1):
-            if not row:
-                break
+        for row, values in enumerate(islice(data, 2, None), start=3):
             item = {}
             error_message = None
-            values = data[row - 1]
-            is_updated = values[index['_STATUS']].strip().upper() if len(values) - 1 > index['_STATUS'] else None
+            is_updated = values[i_status].strip().upper() if len(values) - 1 > i_status else None
+            if is_updated == 'DONE':
+                # already ingested, edited rows must be marked as UPDATED
+                continue
 
             try:
                 # only insert item if _STATUS is empty
+                guid = None
                 if is_updated in ('UPDATED', 'ERROR'):
-                    guid = values[index['_GUID']]
+                    guid = values[i_guid]
                     # check if it's exists and guid is valid
-                    if not superdesk.get_resource_service('events').find_one(guid=guid, req=None):
+                    if guid not in existing_guids:
                         raise KeyError('GUID is not exists')
-                else:
-                    guid = generate_guid(type=GUID_NEWSML)
 
                 # avoid momentsJS throw null timezone value error
-                tzone = values[index['Timezone']] if values[index['Timezone']] != 'none' else 'UTC'
-                start_datetime = parse(values[index['Start date']] + ' ' + values[index['Start time']])
-                end_datetime = parse(values[index['End date']] + ' ' + values[index['End time']])
-                if values[index['All day']] == 'TRUE':
-                    start_datetime = parse(values[index['Start date']])
-                    end_datetime = parse(values[index['End date']]) + timedelta(days=1, seconds=-1)
+                tzone = values[i_timezone] if values[i_timezone] != 'none' else 'UTC'
+                tz = tz_cache.get(tzone) or tz_cache.setdefault(tzone, timezone(tzone))
+                if values[i_all_day] == 'TRUE':
+                    start_datetime = _fast_parse(values[i_start_date])
+                    end_datetime = _fast_parse(values[i_end_date]) + timedelta(days=1, seconds=-1)
+                else:
+                    start_datetime = _fast_parse(values[i_start_date], values[i_start_time])
+                    end_datetime = _fast_parse(values[i_end_date], values[i_end_time])
                 if end_datetime < start_datetime:
                     raise ValueError('End datetime is smaller than Start datetime')
 
                 item = {
                     'type': 'event',
-                    'name': values[index['Event name']],
-                    'slugline': values[index['Slugline']],
+                    'name': values[i_name],
+                    'slugline': values[i_slugline],
                     'dates': {
-                        'start': local_to_utc(tzone, start_datetime),
-                        'end': local_to_utc(tzone, end_datetime),
+                        # like local_to_utc, any offset from the cell is ignored in favour of Timezone
+                        'start': tz.localize(start_datetime.replace(tzinfo=None)).astimezone(utc),
+                        'end': tz.localize(end_datetime.replace(tzinfo=None)).astimezone(utc),
                         'tz': tzone,
                     },
-                    'definition_short': values[index['Description']],
-                    'definition_long': values[index['Long description']],
-                    'internal_note': values[index['Internal note']],
-                    'ednote': values[index['Ed note']],
-                    'links': [values[index['External links']]],
+                    'definition_short': values[i_description],
+                    'definition_long': values[i_long_description],
+                    'internal_note': values[i_internal_note],
+                    'ednote': values[i_ednote],
+                    'links': [values[i_links]],
                     'guid': guid,
                     'status': is_updated,
+                    ITEM_STATE: CONTENT_STATE.DRAFT,
                 }
-                item.setdefault(ITEM_STATE, CONTENT_STATE.DRAFT)
-
-                occur_status = values[index['Occurence status']]
-                if occur_status and occur_status in self.occur_status_qcode_mapping:
-                    item['occur_status'] = {
-                        'qcode': self.occur_status_qcode_mapping.get(values[index['Occurence status']]),
-                        'name': values[index['Occurence status']],
-                        'label': values[index['Occurence status']].lower(),
-                    }
 
-                calendars = values[index['Calendars']]
+                occur_status = occur_statuses.get(values[i_occur_status])
+                if occur_status:
+                    # copy, items must not share nested values
+                    item['occur_status'] = occur_status.copy()
+
+                calendars = values[i_calendars]
                 if calendars:
                     item['calendars'] = [{
                         'is_active': True,
@@ -133,34 +214,33 @@ class BelgaSpreadsheetParser(FeedParser):
                         'qcode': calendars.lower(),
                     }]
 
-                if all(values[index[field]] for field in self.required_location_field):
+                if all(values[i] for i in location_idx):
                     item['location'] = [{
-                        'name': values[index['Location Name']],
+                        'name': values[i_location_name],
                         'address': {
-                            'line': [values[index['Location Address']]],
-                            'locality': values[index['Location City/Town']],
-                            'area': values[index['Location State/Province/Region']],
-                            'country': values[index['Location Country']],
+                            'line': [values[i_location_address]],
+                            'locality': values[i_location_city],
+                            'area': values[i_location_area],
+                            'country': values[i_location_country],
                         }
                     }]
 
-                if all(values[index[field]] for field in self.required_contact_field) \
-                   and (all(values[index[field]] for field in ['Contact First name', 'Contact Last name'])
-                        or values[index['Contact Organisation']]):
-                    is_public = values[index['Contact Phone Public']] == 'TRUE'
-                    if values[index['Contact Phone Usage']] == 'Confidential':
+                if all(values[i] for i in contact_idx) \
+                   and ((values[i_first_name] and values[i_last_name]) or values[i_organisation]):
+                    is_public = values[i_phone_public] == 'TRUE'
+                    if values[i_phone_usage] == 'Confidential':
                         is_public = False
                     item['contact'] = {
-                        'honorific': values[index['Contact Honorific']],
-                        'first_name': values[index['Contact First name']],
-                        'last_name': values[index['Contact Last name']],
-                        'organisation': values[index['Contact Organisation']],
-                        'contact_email': [values[index['Contact Email']]],
-                        'contact_address': [values[index['Contact Point of Contact']]],
+                        'honorific': values[i_honorific],
+                        'first_name': values[i_first_name],
+                        'last_name': values[i_last_name],
+                        'organisation': values[i_organisation],
+                        'contact_email': [values[i_email]],
+                        'contact_address': [values[i_contact_address]],
                         'contact_phone': [{
-                            'number': values[index['Contact Phone Number']],
+                            'number': values[i_phone_number],
                             'public': is_public,
-                            'usage': values[index['Contact Phone Usage']],
+                            'usage': values[i_phone_usage],
                         }]
                     }
                 # ignore invalid item
@@ -172,11 +252,14 @@ class BelgaSpreadsheetParser(FeedParser):
                         provider.get('name'), item.get('name'), missing_fields,
                     )
                     error_message = 'Missing ' + missing_fields + ' fields'
+                elif guid is None:
+                    # new event, only generated once the row is known to be valid
+                    item['guid'] = guid = generate_guid(type=GUID_NEWSML)
             except UnknownTimeZoneError:
                 error_message = 'Invalid timezone'
                 logger.error(
                     'Provider %s: Event "%s": Invalid timezone %s',
-                    provider.get('name'), values[index['Event name']], tzone
+                    provider.get('name'), values[i_name], tzone
                 )
             except (TypeError, ValueError, KeyError) as e:
                 error_message = e.args[0]
@@ -185,18 +268,20 @@ class BelgaSpreadsheetParser(FeedParser):
                     provider.get('name'), item.get('name'), error_message)
 
             if error_message:
+                _add_cell(cells_list, row, values, i_status, 'ERROR')
+                _add_cell(cells_list, row, values, i_err_message, error_message)
+            elif not is_updated:
+                # new item, status and guid change anyway so write the error message in between
+                # to keep the three cells in a single range
                 cells_list.extend([
-                    Cell(row, index['_STATUS'] + 1, 'ERROR'),
-                    Cell(row, index['_ERR_MESSAGE'] + 1, error_message)
+                    Cell(row, i_status + 1, 'DONE'),
+                    Cell(row, i_err_message + 1, ''),
+                    Cell(row, i_guid + 1, guid),
                 ])
-            elif not is_updated or is_updated == 'UPDATED':
-                cells_list.extend([
-                    Cell(row, index['_STATUS'] + 1, 'DONE'),
-                    Cell(row, index['_ERR_MESSAGE'] + 1, ''),
-                ])
-                if not is_updated:
-                    # only update _GUID when status is empty
-                    cells_list.append(Cell(row, index['_GUID'] + 1, guid))
+                items.append(item)
+            elif is_updated == 'UPDATED':
+                _add_cell(cells_list, row, values, i_status, 'DONE')
+                _add_cell(cells_list, row, values, i_err_message, '')
                 items.append(item)
         return items, cells_list
 
@@ -204,15 +289,19 @@ class BelgaSpreadsheetParser(FeedParser):
         """Lookup title columns and return dictionary of titles index
         """
         index = {}
-        titles = [s.lower().strip() for s in titles]
+        title_map = {}
+        for i, title in enumerate(titles):
+            # keep the first column when a title is repeated
+            title_map.setdefault(title.lower().strip(), i)
         for field in self.titles:
-            if field.lower().strip() not in titles:
+            try:
+                index[field] = title_map[field.lower().strip()]
+            except KeyError:
                 raise ParserError.parseFileError()
-            index[field] = titles.index(field.lower().strip())
         # generate_fields may not present when testing config
         for field in self.generate_fields:
-            if field.lower().strip() in titles:
-                index[field] = titles.index(field.lower().strip())
+            if field.lower().strip() in title_map:
+                index[field] = title_map[field.lower().strip()]
 
         return index
 
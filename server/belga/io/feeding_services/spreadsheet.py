@@ -8,13 +8,17 @@
 # AUTHORS and LICENSE files distributed with this source code, or
 # at https://www.sourcefabric.org/superdesk/license
 
+import hashlib
 import json
 import logging
 from copy import deepcopy
 from datetime import datetime
 
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from gspread import Cell
+from gspread.models import Worksheet
+from gspread.urls import SPREADSHEET_URL, SPREADSHEETS_API_V4_BASE_URL
+from gspread.utils import rowcol_to_a1
 
 import superdesk
 from belga.io.feed_parsers.belga_spreadsheet import BelgaSpreadsheetParser
@@ -26,6 +30,32 @@ from superdesk.metadata.utils import generate_guid
 
 logger = logging.getLogger(__name__)
 
+SPREADSHEET_VALUES_BATCH_UPDATE_URL = SPREADSHEETS_API_V4_BASE_URL + '/%s/values:batchUpdate'
+
+# authorized gspread clients by sha256 of service account json
+_clients = {}
+
+
+def _get_client(service_account):
+    """Get authorized gspread client, reused between ingest runs using the same service account"""
+    key = hashlib.sha256(service_account.encode()).hexdigest()
+    if key not in _clients:
+        # oauth2client pulls in the whole crypto stack, only import it once a client is needed
+        from oauth2client.service_account import ServiceAccountCredentials
+
+        scope = [
+            'https://spreadsheets.google.com/feeds',
+            'https://www.googleapis.com/auth/drive',
+        ]
+        credentials = ServiceAccountCredentials.from_json_keyfile_dict(json.loads(service_account), scope)
+        _clients[key] = gspread.authorize(credentials)
+    return _clients[key]
+
+
+def _quote_title(title):
+    """Quote sheet title for use in A1 notation"""
+    return "'%s'" % title.replace("'", "''")
+
 
 class IngestSpreadsheetError(SuperdeskIngestError):
     _codes = {
@@ -66,6 +96,8 @@ class SpreadsheetFeedingService(FeedingService):
 
     label = 'Events from Google Documents Spreadsheet'
 
+    update_cells_chunk_size = 40000
+
     fields = [
         {
             'id': 'service_account', 'type': 'text', 'label': 'Service account',
@@ -89,8 +121,7 @@ class SpreadsheetFeedingService(FeedingService):
     ]
 
     def _test(self, provider):
-        worksheet = self._get_worksheet(provider)
-        data = worksheet.get_all_values()
+        _, data = self._get_worksheet(provider)
         BelgaSpreadsheetParser().parse_titles(data[0])
 
     def _update(self, provider, update):
@@ -99,10 +130,8 @@ class SpreadsheetFeedingService(FeedingService):
         If STATUS field is empty, create new item
         If STATUS field is UPDATED, update item
         """
-        worksheet = self._get_worksheet(provider)
-
         # Get all values to avoid reaching read limit
-        data = worksheet.get_all_values()
+        worksheet, data = self._get_worksheet(provider)
         titles = [s.lower().strip() for s in data[0]]
 
         # avoid maximum limit cols error
@@ -110,46 +139,46 @@ class SpreadsheetFeedingService(FeedingService):
         if total_col < len(titles) + 3:
             worksheet.add_cols(len(titles) + 3 - total_col)
 
+        header_cells = []
         for field in ('_STATUS', '_ERR_MESSAGE', '_GUID'):
             if field.lower() not in titles:
                 titles.append(field)
-                worksheet.update_cell(1, len(titles), field)
+                header_cells.append(Cell(1, len(titles), field))
+        if header_cells:
+            worksheet.update_cells(header_cells)
         data[0] = titles  # pass to parser uses for looking up index
 
         parser = BelgaSpreadsheetParser()
         items, cells_list = parser.parse(data, provider)
+        # sheet values are not needed anymore, don't keep them while items are ingested
+        del data
         items = self._process_event_items(items, provider)
         # add ingest item
         yield items
-        # Update status for google sheet
-        if cells_list:
-            worksheet.update_cells(cells_list)
+        # Update status for google sheet, in chunks to stay below the cells limit per request
+        for i in range(0, len(cells_list), self.update_cells_chunk_size):
+            self._update_cells(worksheet, cells_list[i:i + self.update_cells_chunk_size])
 
     def _get_worksheet(self, provider):
-        """Get worksheet from google spreadsheet
+        """Get worksheet and its values from google spreadsheet
 
-        :return: worksheet
-        :rtype: object
+        :return: worksheet, list of rows values
+        :rtype: tuple
         """
-        scope = [
-            'https://spreadsheets.google.com/feeds',
-            'https://www.googleapis.com/auth/drive',
-        ]
         config = provider.get('config', {})
         url = config.get('url', '')
         service_account = config.get('service_account', '')
         title = config.get('worksheet_title', '')
 
         try:
-            service_account = json.loads(service_account)
-            credentials = ServiceAccountCredentials.from_json_keyfile_dict(service_account, scope)
-            gc = gspread.authorize(credentials)
+            gc = _get_client(service_account)
+            # cached client keeps its token, refresh it once expired
+            gc.login()
             spreadsheet = gc.open_by_url(url)
             permission = spreadsheet.list_permissions()[0]
             if permission['role'] != 'writer':
                 raise IngestSpreadsheetError.SpreadsheetPermissionError()
-            worksheet = spreadsheet.worksheet(title)
-            return worksheet
+            return self._fetch_worksheet(spreadsheet, title)
         except (json.decoder.JSONDecodeError, AttributeError, ValueError) as e:
             # both permission and credential raise Value error
             if e.args[0] == 15100:
@@ -170,6 +199,66 @@ class SpreadsheetFeedingService(FeedingService):
             else:
                 raise IngestApiError.apiNotFoundError()
 
+    def _fetch_worksheet(self, spreadsheet, title):
+        """Fetch worksheet properties and formatted values using a single request
+
+        Values are trimmed and padded the same way as ``Worksheet.get_all_values``.
+        """
+        try:
+            metadata = spreadsheet.client.request('get', SPREADSHEET_URL % spreadsheet.id, params={
+                'includeGridData': 'true',
+                'ranges': _quote_title(title),
+                'fields': 'sheets(properties,data.rowData.values.formattedValue)',
+            }).json()
+        except gspread.exceptions.APIError as e:
+            # unknown sheet title makes the range invalid
+            if e.response.status_code == 400:
+                raise gspread.exceptions.WorksheetNotFound(title)
+            raise
+        if not metadata.get('sheets'):
+            raise gspread.exceptions.WorksheetNotFound(title)
+
+        sheet = metadata['sheets'][0]
+        worksheet = Worksheet(spreadsheet, sheet['properties'])
+        data = []
+        for grid in sheet.get('data', []):
+            for row in grid.get('rowData', []):
+                values = [cell.get('formattedValue', '') for cell in row.get('values', [])]
+                while values and not values[-1]:
+                    values.pop()
+                data.append(values)
+        while data and not data[-1]:
+            data.pop()
+        width = max((len(values) for values in data), default=0)
+        return worksheet, [values + [''] * (width - len(values)) for values in data]
+
+    def _update_cells(self, worksheet, cells_list):
+        """Write cells using a single values batchUpdate request
+
+        Adjacent cells of a row are grouped into one range, so unchanged cells between them are not sent.
+        """
+        title = _quote_title(worksheet.title)
+        data = []
+        run = []
+        for cell in sorted(cells_list, key=lambda cell: (cell.row, cell.col)):
+            if run and (cell.row != run[-1].row or cell.col != run[-1].col + 1):
+                data.append(self._cells_range(title, run))
+                run = []
+            run.append(cell)
+        if run:
+            data.append(self._cells_range(title, run))
+        if data:
+            url = SPREADSHEET_VALUES_BATCH_UPDATE_URL % worksheet.spreadsheet.id
+            worksheet.client.request('post', url, json={'valueInputOption': 'RAW', 'data': data})
+
+    def _cells_range(self, title, cells):
+        return {
+            'range': '%s!%s:%s' % (
+                title, rowcol_to_a1(cells[0].row, cells[0].col), rowcol_to_a1(cells[-1].row, cells[-1].col)
+            ),
+            'values': [[cell.value for cell in cells]],
+        }
+
     def _process_event_items(self, items, provider):
         events_service = superdesk.get_resource_service('events')
         list_items = []
@@ -8,6 +8,7 @@
 # AUTHORS and LICENSE files distributed with this source code, or
 # at https://www.sourcefabric.org/superdesk/license
 from datetime import datetime, timezone
+from unittest import mock
 
 from belga.io.feed_parsers.belga_spreadsheet import BelgaSpreadsheetParser
 from tests import TestCase
@@ -32,6 +33,18 @@ data = [
 
 ]
 
+# values not handled by the fast path, parsed by dateutil
+fallback_data = data[:2] + [
+    ['06/05/2019', '7:00 PM', '06/05/2019', '8:00 PM', 'FALSE', 'Europe/Brussels', 'Slugline6', 'Event 6',
+     'Description', '', 'Culture'] + [''] * 21,
+    ['2019-02-30', '7:00', '2019-03-01', '7:00', 'FALSE', 'Europe/Brussels', 'Slugline7', 'Event 7',
+     'Description', '', 'Culture'] + [''] * 21,
+    ['2019-06-20', '24:00', '2019-06-21', '7:00', 'FALSE', 'Europe/Brussels', 'Slugline8', 'Event 8',
+     'Description', '', 'Culture'] + [''] * 21,
+    ['2019-06-20', '7:00', '2019-06-20', '08:00+02:00', 'FALSE', 'Europe/Brussels', 'Slugline9', 'Event 9',
+     'Description', '', 'Culture'] + [''] * 21,
+]
+
 
 class BelgaSpreadsheetsTestCase(TestCase):
     def setUp(self):
@@ -85,9 +98,70 @@ class BelgaSpreadsheetsTestCase(TestCase):
             'tz': 'Europe/Brussels'
         })
 
+    def test_guid(self):
+        self.assertTrue(self.items[0]['guid'])
+        self.assertNotEqual(self.items[0]['guid'], self.items[1]['guid'])
+
     def test_error(self):
         error = [c.value for c in self.error[6:]]  # ignore first 6 non-error cells
         self.assertListEqual(error, [
             'ERROR', 'Invalid timezone',
             'ERROR', 'String does not contain a date:',
         ])
+
+    def test_new_item_cells(self):
+        cells = [(c.row, c.col, c.value) for c in self.error[:3]]
+        self.assertListEqual(cells, [(3, 30, 'DONE'), (3, 31, ''), (3, 32, self.items[0]['guid'])])
+
+    def test_unchanged_cells(self):
+        values = data[2][:-3] + ['ERROR', 'GUID is not exists', 'unknown']
+        items, cells = self.parser.parse(data[:2] + [values], {'name': 'test'})
+        self.assertListEqual(items, [])
+        self.assertListEqual(cells, [])
+
+    def test_updated_row(self):
+        guid = 'urn:newsml:localhost:2019:updated'
+        values = data[2][:-3] + [' updated ', '', guid]
+        with mock.patch('superdesk.get_resource_service') as get_resource_service:
+            get_resource_service.return_value.find.return_value = [{'guid': guid}]
+            items, cells = self.parser.parse(data[:2] + [values], {'name': 'test'})
+        get_resource_service.assert_called_once_with('events')
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0]['guid'], guid)
+        # error message is already empty, guid is kept
+        self.assertListEqual([(c.row, c.col, c.value) for c in cells], [(3, 30, 'DONE')])
+
+    def test_done_row_is_skipped(self):
+        values = ['', '7:00', 'bad date', '7:00', 'FALSE', 'Europe/Bruss', 'Slugline5', ''] + [''] * 21 + \
+            ['DONE', '', 'urn:newsml:localhost:2019:done']
+        items, cells = self.parser.parse(data[:2] + [values], {'name': 'test'})
+        self.assertListEqual(items, [])
+        self.assertListEqual(cells, [])
+
+    def test_dateutil_fallback(self):
+        items, cells = self.parser.parse(fallback_data, {'name': 'test'})
+        self.assertEqual(len(items), 1)
+        # month first
+        self.assertDictEqual(items[0]['dates'], {
+            'start': datetime(2019, 6, 5, 17, tzinfo=timezone.utc),
+            'end': datetime(2019, 6, 5, 18, tzinfo=timezone.utc),
+            'tz': 'Europe/Brussels'
+        })
+        error = [c.value for c in cells[3:]]  # ignore first 3 non-error cells
+        self.assertListEqual(error, [
+            'ERROR', 'day is out of range for month',
+            'ERROR', 'hour must be in 0..23',
+            'ERROR', "can't compare offset-naive and offset-aware datetimes",  # only end time has an offset
+        ])
+
+    def test_offset_times(self):
+        values = ['2019-06-20', '08:00+02:00', '2019-06-20', '09:00+02:00', 'FALSE', 'Europe/Brussels',
+                  'Slugline10', 'Event 10', 'Description', '', 'Culture'] + [''] * 21
+        items, cells = self.parser.parse(data[:2] + [values], {'name': 'test'})
+        # offsets are ignored, times are local to the Timezone column
+        self.assertDictEqual(items[0]['dates'], {
+            'start': datetime(2019, 6, 20, 6, tzinfo=timezone.utc),
+            'end': datetime(2019, 6, 20, 7, tzinfo=timezone.utc),
+            'tz': 'Europe/Brussels'
+        })
+        self.assertEqual(cells[0].value, 'DONE')
@@ -0,0 +1,105 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2013 - 2019 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+from unittest import mock
+
+import gspread
+
+from belga.io.feeding_services.spreadsheet import SpreadsheetFeedingService
+from tests import TestCase
+
+
+metadata = {
+    'sheets': [{
+        'properties': {
+            'sheetId': 1,
+            'title': "It's",
+            'gridProperties': {'rowCount': 100, 'columnCount': 32},
+        },
+        'data': [{
+            'rowData': [
+                {'values': [{'formattedValue': 'Start date'}, {'formattedValue': 'Start time'}, {}, {}]},
+                {},
+                {'values': [{'formattedValue': '2019-06-20'}, {}, {'formattedValue': 'Event 1'}]},
+                {'values': [{}, {'formattedValue': ''}]},
+                {},
+            ],
+        }],
+    }],
+}
+
+
+class SpreadsheetFetchWorksheetTestCase(TestCase):
+    def setUp(self):
+        self.service = SpreadsheetFeedingService()
+        self.spreadsheet = gspread.Spreadsheet(mock.Mock(), {'id': 'sheet_id'})
+        self.request = self.spreadsheet.client.request
+
+    def test_values(self):
+        self.request.return_value.json.return_value = metadata
+        worksheet, data = self.service._fetch_worksheet(self.spreadsheet, "It's")
+
+        self.assertEqual(worksheet.title, "It's")
+        self.assertEqual(worksheet.col_count, 32)
+        self.assertListEqual(data, [
+            ['Start date', 'Start time', ''],
+            ['', '', ''],
+            ['2019-06-20', '', 'Event 1'],
+        ])
+        self.request.assert_called_once_with(
+            'get', 'https://sheets.googleapis.com/v4/spreadsheets/sheet_id', params={
+                'includeGridData': 'true',
+                'ranges': "'It''s'",
+                'fields': 'sheets(properties,data.rowData.values.formattedValue)',
+            })
+
+    def test_unknown_title(self):
+        response = mock.Mock(status_code=400, text='Unable to parse range')
+        response.json.side_effect = ValueError
+        self.request.side_effect = gspread.exceptions.APIError(response)
+        with self.assertRaises(gspread.exceptions.WorksheetNotFound):
+            self.service._fetch_worksheet(self.spreadsheet, 'Unknown')
+
+    def test_no_sheets(self):
+        self.request.return_value.json.return_value = {}
+        with self.assertRaises(gspread.exceptions.WorksheetNotFound):
+            self.service._fetch_worksheet(self.spreadsheet, 'Unknown')
+
+
+class SpreadsheetUpdateCellsTestCase(TestCase):
+    def setUp(self):
+        self.service = SpreadsheetFeedingService()
+        spreadsheet = gspread.Spreadsheet(mock.Mock(), {'id': 'sheet_id'})
+        self.worksheet = gspread.Worksheet(spreadsheet, {'sheetId': 1, 'title': "It's"})
+        self.request = spreadsheet.client.request
+
+    def test_ranges(self):
+        self.service._update_cells(self.worksheet, [
+            gspread.Cell(4, 31, ''),
+            gspread.Cell(3, 30, 'DONE'),
+            gspread.Cell(4, 30, 'ERROR'),
+            gspread.Cell(3, 32, 'guid'),
+            gspread.Cell(5, 30, 'DONE'),
+            gspread.Cell(5, 31, ''),
+            gspread.Cell(5, 32, 'guid 2'),
+        ])
+        self.request.assert_called_once_with(
+            'post', 'https://sheets.googleapis.com/v4/spreadsheets/sheet_id/values:batchUpdate', json={
+                'valueInputOption': 'RAW',
+                'data': [
+                    {'range': "'It''s'!AD3:AD3", 'values': [['DONE']]},
+                    {'range': "'It''s'!AF3:AF3", 'values': [['guid']]},
+                    {'range': "'It''s'!AD4:AE4", 'values': [['ERROR', '']]},
+                    {'range': "'It''s'!AD5:AF5", 'values': [['DONE', '', 'guid 2']]},
+                ],
+            })
+
+    def test_no_cells(self):
+        self.service._update_cells(self.worksheet, [])
+        self.request.assert_not_called()